@@ -1,6 +1,12 @@
 
 DEFAULT_MAP_SKIP_POINTS = 3
 DEFAULT_MAP_MAX_ALLOWED_DISTANCE = 500
+DEFAULT_MAP_HISTORY_CAPACITY = 256
+DEFAULT_MAP_MIN_RENDER_INTERVAL = 0.1
+DEFAULT_MAP_IMAGE_FORMAT = "PNG"
+MAP_IMAGE_FORMATS = ("PNG","WEBP")
+DEFAULT_MAP_PNG_COMPRESS_LEVEL = 1
+DEFAULT_MAP_WEBP_QUALITY = 80
 DEFAULT_BG_COLOR = (0,0,0,0)
 DEFAULT_PATH_COLOR = (0,0,180,127)
 DEFAULT_TEXT_COLOR = (255,255,255,255)
@@ -11,9 +17,11 @@ DEFAULT_PATH_WIDTH = 2
 DEFAULT_MAP_MIN_COORDS = (-1000,-1000)
 DEFAULT_MAP_MAX_COORDS = (1000,1000)
 DEFAULT_MAP_ANGLE = 0.0
+DEFAULT_TEXT_CACHE_SIZE = 64
 
 DEFAULT_ICON_PATH = "{PKG}/assets"
 DEFAULT_ICON_SIZE = (50,50)
+DEFAULT_ICON_ROTATION_STEP = 5
 DEFAULT_ICON_HOME = "home.png"
 DEFAULT_ICON_ROOMBA = "r865_icon.png"
 DEFAULT_ICON_ERROR = "overlay-error.png"
@@ -1,3 +1,4 @@
+import functools
 from typing import Tuple
 from .math_helpers import clamp
 
@@ -21,6 +22,31 @@ def transparent_paste(base_image: Image.Image, overlay_image: Image.Image, posit
     base_image = Image.alpha_composite(base_image, image)
     return base_image
 
+def is_opaque(image: Image.Image) -> bool:
+    '''
+    true if the image has no transparent pixels, so it can be pasted
+    rather than alpha composited
+    '''
+    if image is None:
+        return False
+    if "A" not in image.getbands():
+        return True
+    return image.getchannel("A").getextrema()[0] == 255
+
+def crop_transparent_margin(image: Image.Image) -> Image.Image:
+    '''
+    crops off the fully transparent border, by the same amount on each side
+    so that the image keeps its center, compositing those pixels is wasted work
+    '''
+    bbox = image.getchannel("A").getbbox()
+    if bbox is None:
+        return image
+    width, height = image.size
+    margin = min(bbox[0], bbox[1], width - bbox[2], height - bbox[3])
+    if margin == 0:
+        return image
+    return image.crop((margin, margin, width - margin, height - margin))
+
 def center_image(ox: int, oy: int, image: Image.Image, bounds: Tuple[int,int]) -> Tuple[int,int]:
     xx, yy = (ox - image.size[0] // 2, oy - image.size[1] // 2)
     if bounds:
@@ -29,8 +55,40 @@ def center_image(ox: int, oy: int, image: Image.Image, bounds: Tuple[int,int]) -
         
     return (xx, yy)
             
+def get_text_width(font: ImageFont.ImageFont, text: str) -> float:
+    '''
+    getsize is deprecated (and removed in Pillow 10), but getlength isn't
+    available for bitmap fonts in older versions
+    '''
+    if hasattr(font, "getlength"):
+        return font.getlength(text)
+    return font.getsize(text)[0]
+
+def resize_icon(image: Image.Image, size: Tuple[int,int]) -> Image.Image:
+    '''
+    resizes with lanczos (ANTIALIAS is removed in Pillow 10), reducing large
+    sources by whole factors first since the full filter is expensive
+    '''
+    image = image.convert('RGBA')
+    if image.size == tuple(size):
+        return image
+    resampling = getattr(Image, "Resampling", Image)
+    return image.resize(size, resampling.LANCZOS, reducing_gap=2.0)
+
 def validate_color(color, default) -> Tuple[int,int,int,int]:      
+    if isinstance(color, tuple):
+        #already a color, just make sure it's a valid RGB(A) one
+        if (len(color) in (3, 4) and 
+            all(isinstance(c, int) and 0 <= c <= 255 for c in color)):
+            return color if len(color) == 4 else color + (255,)
+        return default
+    if not isinstance(color, str):
+        return default
     try:
-        return ImageColor.getcolor(color,"RGBA")
-    except:
+        return _get_color(color)
+    except ValueError:
         return default
+
+@functools.lru_cache(maxsize=64)
+def _get_color(color: str) -> Tuple[int,int,int,int]:
+    return ImageColor.getcolor(color,"RGBA")
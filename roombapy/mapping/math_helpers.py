@@ -4,6 +4,13 @@ from typing import Tuple
 def clamp(num, min_value, max_value):
    return max(min(num, max_value), min_value)
 
+def distance_sq(x1, y1, x2, y2) -> float:
+    dx = x2 - x1
+    dy = y2 - y1
+    return dx*dx + dy*dy
+
+#interpolate and rotate are no longer used by the renderer, the map transform
+#precomputes both, but they stay as helpers for code that imports them
 def interpolate(value, in_range, out_range) -> float:
     
     #handle inverted ranges
@@ -25,11 +32,12 @@ def interpolate(value, in_range, out_range) -> float:
     return out
 
 def rotate(x, y, angle, invert_x: bool = False, invert_y: bool = False) -> Tuple[float,float]:
-    xx = x*math.cos(math.radians(angle)) - \
-         y*math.sin(math.radians(angle))
-    yy = x*math.sin(math.radians(angle)) + \
-         y*math.cos(math.radians(angle))    
-    
+    rad = math.radians(angle)
+    c = math.cos(rad)
+    s = math.sin(rad)
+    xx = x*c - y*s
+    yy = x*s + y*c
+
     if invert_x:
         xx = x - (xx - x)
     if invert_y:
@@ -16,9 +16,11 @@ from .const import (
     DEFAULT_ICON_HOME,
     DEFAULT_ICON_PATH,
     DEFAULT_ICON_ROOMBA,
+    DEFAULT_ICON_ROTATION_STEP,
     DEFAULT_ICON_SIZE,
     DEFAULT_ICON_TANK_LOW
 )
+from .image_helpers import crop_transparent_margin, resize_icon
 from .misc_helpers import get_mapper_asset
 
 class RoombaIconSet:
@@ -35,6 +37,7 @@ class RoombaIconSet:
         self.size = size
         self.show_direction = show_direction
         self._icons: dict[str,Image.Image] = {}
+        self._rotated_roomba: list[Image.Image] = None
         self._load_defaults()
 
     @property
@@ -101,6 +104,22 @@ class RoombaIconSet:
     def home(self, value):
         self._set_icon("home", value)
 
+    def rotated_roomba(self, theta: int) -> Image.Image:
+        '''
+        roomba icon rotated by theta degrees (to the nearest rotation step),
+        all the rotations are generated the first time one is needed, without
+        the transparent corners expanding the canvas adds
+        '''
+        if self._rotated_roomba is None:
+            self._rotated_roomba = [
+                crop_transparent_margin(
+                    self.roomba.rotate(a, resample=Image.BILINEAR, expand=True)
+                )
+                for a in range(0, 360, DEFAULT_ICON_ROTATION_STEP)
+            ]
+        step = int(round(theta / DEFAULT_ICON_ROTATION_STEP))
+        return self._rotated_roomba[step % len(self._rotated_roomba)]
+
     def _load_defaults(self):
         self._load_icon_file("roomba", get_mapper_asset(DEFAULT_ICON_PATH, DEFAULT_ICON_ROOMBA))
         self._load_icon_file("error", get_mapper_asset(DEFAULT_ICON_PATH, DEFAULT_ICON_ERROR))
@@ -118,18 +137,20 @@ class RoombaIconSet:
             self._load_icon_file(name, value)
             self._draw_direction(name)
         elif isinstance(value, Image.Image):
-            resized = value.convert('RGBA').resize(self.size,Image.ANTIALIAS)
-            self._icons[name] = resized
+            self._icons[name] = resize_icon(value, self.size)
             self._draw_direction(name)
         else:
             raise ValueError()
 
+        if name == "roomba":
+            self._rotated_roomba = None
+
     def _load_icon_file(self, name, filename, size=None):
         try:
             if not size:
                 size = self.size
-            icon = Image.open(filename).convert('RGBA').resize(
-                size,Image.ANTIALIAS)
+            with Image.open(filename) as image:
+                icon = resize_icon(image, size)
                     
             self._icons[name] = icon
         except IOError as e:
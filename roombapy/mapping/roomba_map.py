@@ -1,5 +1,6 @@
 import logging
-from typing import Tuple, Optional
+import math
+from typing import NamedTuple, Tuple, Optional
 
 try:
     from PIL import Image
@@ -21,6 +22,22 @@ from .const import (
 )
 from .image_helpers import make_blank_image, validate_color
 
+class RoombaMapTransform(NamedTuple):
+    """Precomputed constants to go from roomba to image coordinates"""
+    angle: float
+    cos: float
+    sin: float
+    invert_x: bool
+    invert_y: bool
+    min_x: float
+    max_x: float
+    min_y: float
+    max_y: float
+    scale_x: float
+    offset_x: float
+    scale_y: float
+    offset_y: float
+
 class RoombaMap:
     _id: str
     _name: str
@@ -33,6 +50,7 @@ class RoombaMap:
     _path_color: Tuple[int,int,int,int] = None
     _text_color: Tuple[int,int,int,int] = None
     _text_bg_color: Tuple[int,int,int,int] = None
+    _transform: RoombaMapTransform = None
     icon_set: str = None
     device: str = None
     
@@ -82,6 +100,7 @@ class RoombaMap:
     @coords_start.setter
     def coords_start(self, value):
         self._coords_start = self._validate_coords(value, self._coords_start or DEFAULT_MAP_MIN_COORDS)
+        self._transform = None
 
     @property
     def coords_end(self) -> Tuple[int,int]:
@@ -90,6 +109,7 @@ class RoombaMap:
     @coords_end.setter
     def coords_end(self, value):
         self._coords_end = self._validate_coords(value, self._coords_end or DEFAULT_MAP_MAX_COORDS)
+        self._transform = None
 
     @property
     def angle(self) -> float:
@@ -98,6 +118,7 @@ class RoombaMap:
     @angle.setter
     def angle(self, value):
         self._angle = self._validate_angle(value, self._angle or DEFAULT_MAP_ANGLE)        
+        self._transform = None
 
     @property
     def floorplan(self) -> Image.Image:
@@ -108,6 +129,7 @@ class RoombaMap:
         self._floorplan = self._set_image(value)
         if not self._floorplan:
             self._floorplan = make_blank_image(DEFAULT_IMG_WIDTH, DEFAULT_IMG_HEIGHT)
+        self._transform = None
 
     @property
     def walls(self) -> Image.Image:
@@ -175,11 +197,53 @@ class RoombaMap:
         else:
             return DEFAULT_IMG_HEIGHT
 
+    @property
+    def transform(self) -> RoombaMapTransform:
+        if self._transform is None:
+            self._transform = self._compute_transform()
+        return self._transform
+
+    def _compute_transform(self) -> RoombaMapTransform:
+        """Computes the rotation, scale and offset for this map, as they only 
+        change along with the coordinates, angle, or floorplan"""
+        rad = math.radians(self.angle)
+        start_x, start_y = self.coords_start
+        end_x, end_y = self.coords_end
+
+        #the x,y scale and offset map the coordinate range to [0, size - 1], 
+        #flipped if the range is inverted
+        scale_x, offset_x = self._compute_scale(start_x, end_x, self.img_width)
+        scale_y, offset_y = self._compute_scale(start_y, end_y, self.img_height)
+
+        return RoombaMapTransform(
+            angle = self.angle,
+            cos = math.cos(rad),
+            sin = math.sin(rad),
+            invert_x = start_x > end_x,
+            invert_y = start_y < end_y,
+            min_x = min(start_x, end_x),
+            max_x = max(start_x, end_x),
+            min_y = min(start_y, end_y),
+            max_y = max(start_y, end_y),
+            scale_x = scale_x,
+            offset_x = offset_x,
+            scale_y = scale_y,
+            offset_y = offset_y
+        )
+
+    def _compute_scale(self, start, end, size) -> Tuple[float,float]:
+        #positions are scaled as offset + (value - low) / (high - low) * scale,
+        #the same operations (and so the same rounding) as interpolate
+        if start > end:
+            return -float(size - 1), float(size - 1)
+        return float(size - 1), 0.0
+
     def _set_image(self, value):
         if value is None:
             return None   
         if isinstance(value, str):
-            return Image.open(value).convert('RGBA')
+            with Image.open(value) as image:
+                return image.convert('RGBA')
         elif isinstance(value, Image.Image):
             return value
         else:
@@ -200,9 +264,9 @@ class RoombaMap:
             return default
         try:
             v = float(value)
-            v %= 360
-            if v < 0:
-                v += 360
-            return v
-        except:
-            return default
\ No newline at end of file
+        except (TypeError, ValueError):
+            return default
+        v %= 360
+        if v < 0:
+            v += 360
+        return v
\ No newline at end of file
@@ -1,9 +1,12 @@
+import functools
 import io
 import math
 import logging
 import os
+import threading
 import time
-from typing import TYPE_CHECKING, NamedTuple, Tuple
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, NamedTuple, Tuple
 import textwrap
 
 # Import trickery
@@ -11,10 +14,17 @@ global HAVE_PIL
 HAVE_PIL = False
 
 try:
-    from PIL import Image, ImageDraw, ImageFont
+    import PIL
+    from PIL import Image, ImageDraw, ImageFont, features
+    import numpy as np
     HAVE_PIL = True
+    #Pillow-SIMD releases are versioned as post releases of Pillow
+    if ".post" in PIL.__version__:
+        logging.getLogger(__name__).debug(f"Maps rendered using Pillow-SIMD {PIL.__version__}")
+    else:
+        logging.getLogger(__name__).debug(f"Maps rendered using PIL {PIL.__version__}")
 except ImportError:
-    print("PIL module not found, maps are disabled")
+    print("PIL or numpy module not found, maps are disabled")
 
 if TYPE_CHECKING:
     from ..roomba import Roomba
@@ -23,14 +33,28 @@ from ..const import ROOMBA_STATES
 from .const import (
     DEFAULT_BG_COLOR,
     DEFAULT_ICON_SIZE,
+    DEFAULT_MAP_HISTORY_CAPACITY,
+    DEFAULT_MAP_IMAGE_FORMAT,
     DEFAULT_MAP_MAX_ALLOWED_DISTANCE,
+    DEFAULT_MAP_MIN_RENDER_INTERVAL,
+    DEFAULT_MAP_PNG_COMPRESS_LEVEL,
     DEFAULT_MAP_SKIP_POINTS,
+    DEFAULT_MAP_WEBP_QUALITY,
     DEFAULT_PATH_COLOR,
-    DEFAULT_PATH_WIDTH
+    DEFAULT_PATH_WIDTH,
+    DEFAULT_TEXT_CACHE_SIZE,
+    MAP_IMAGE_FORMATS
+)
+from .math_helpers import clamp, distance_sq
+from .image_helpers import (
+    transparent, 
+    make_blank_image, 
+    center_image, 
+    is_opaque, 
+    get_text_width
 )
-from .math_helpers import clamp, rotate, interpolate
-from .image_helpers import transparent, make_blank_image, center_image
 from .misc_helpers import get_mapper_asset
+from .transform_helpers import HAVE_NUMBA, process_pose, translate_pose, translate_poses
 from .roomba_icon_set import RoombaIconSet
 from .roomba_map_device import RoombaMapDevice
 from .roomba_map import RoombaMap
@@ -48,28 +72,41 @@ class MapRenderParameters(NamedTuple):
     path_width: int
     
 class RoombaMapper:
+    #flags that have a problem icon, in priority order, with the icon to use
+    _PROBLEM_ICONS = (
+        ('stuck', 'error'),
+        ('cancelled', 'cancelled'),
+        ('bin_full', 'bin_full'),
+        ('battery_low', 'battery_low'),
+        ('tank_low', 'tank_low')
+    )
+
     def __init__(self, 
         roomba: 'Roomba', 
         font: ImageFont.ImageFont = None,
 
-        assets_path = "{PKG}/assets"
+        assets_path = "{PKG}/assets",
+        image_format = DEFAULT_MAP_IMAGE_FORMAT
     ):
         self.log = logging.getLogger(__name__)
         self.roomba = roomba
         self.map_enabled = False
         self.assets_path = assets_path
 
-        #initialize the font
-        self.font = font
-        if self.font is None:
-            try:
-                self.font = ImageFont.truetype(get_mapper_asset(assets_path, "monaco.ttf"), 30)
-            except Exception as e:
-                self.log.warning(f"Error loading font, loading default font")
-                self.font = ImageFont.load_default()
+        #maps are encoded as PNG or WEBP, anything else (or WEBP without 
+        #libwebp in this Pillow build) falls back to the default
+        self.image_format = str(image_format).upper()
+        if (self.image_format not in MAP_IMAGE_FORMATS or 
+            (self.image_format == "WEBP" and HAVE_PIL and not features.check("webp"))):
+            self.log.warning(f"Unsupported map image format '{image_format}', using {DEFAULT_MAP_IMAGE_FORMAT}")
+            self.image_format = DEFAULT_MAP_IMAGE_FORMAT
+
+        #the font is loaded on first use
+        self._font = font
 
-        #generate the default icons
+        #register the default icons, each set is only loaded once it's used
         self._icons: dict[str,RoombaIconSet] = {}
+        self._icon_set_factories: dict[str,Callable[[],RoombaIconSet]] = {}
         self.add_icon_set("default"),
         self.add_icon_set("m", roomba_icon="m6_icon.png")
         self.add_icon_set("j", roomba_icon="j7_icon.png")
@@ -80,49 +117,92 @@ class RoombaMapper:
         self._device: RoombaMapDevice = None
         self._render_params: MapRenderParameters = None
         self._rendered_map: Image.Image = None
+        self._encoded_map: tuple = None
         self._base_rendered_map: Image.Image = None
+        self._path_layer: Image.Image = None
+        self._path_drawn = 0
+        self._map_layer: Image.Image = None
+        self._map_layer_dock: Image.Image = None
+        self._static_layer: Image.Image = None
+        self._static_key: tuple = None
         self._points_to_skip = DEFAULT_MAP_SKIP_POINTS
         self._points_skipped = 0
         self._max_distance = DEFAULT_MAP_MAX_ALLOWED_DISTANCE
-        self._history = []
-        self._history_translated: list[RoombaPosition] = []
+        self._clear_history()
+        self._last_render_sig: tuple = None
+        self._last_render_time = 0.0
+        self._lock = threading.RLock()
+
+        #renders happen on a single worker so that they are serialized and 
+        #state updates aren't held up while the map is drawn, the render lock
+        #only guards the scheduling state so it is never held during a render,
+        #the worker is started on the first render and stopped by close
+        self._render_executor: ThreadPoolExecutor = None
+        self._render_lock = threading.Lock()
+        self._render_future: Future = None
+        self._render_pending = False
+        self._path_stale = False
+        self._render_generation = 0
+        self._floorplan_opaque = False
+        self._walls_opaque = False
+        self._origin_image_pos: RoombaPosition = None
+        self._dock_pos: Tuple[int,int] = None
+        self._dock_icon: Image.Image = None
+        self._text_cache: dict[tuple,Image.Image] = {}
+        self._problem_icon_key: tuple = None
+        self._problem_icon: Image.Image = None
 
         #initialize a base map
         self._initialize_map()
 
     @property
     def roomba_image_pos(self) -> RoombaPosition:       
-        try:
-            #roomba sometimes doesn't show the right coords when docked,
-            #override the coordinates just in case
-            if self.roomba.docked:
-                return self._map_coord_to_image_coord(self.roomba.zero_coords())
-            return self._history_translated[-1]
-        except:
-            return RoombaPosition(None,None,None)
+        #roomba sometimes doesn't show the right coords when docked,
+        #override the coordinates just in case
+        if self.roomba.docked:
+            return self.origin_image_pos
+        if self._history_img_len > 0:
+            i = self._history_img_len - 1
+            x, y = self._history_img_xy[i].tolist()
+            return RoombaPosition(x, y, int(self._history_img_theta[i]))
+        return RoombaPosition(None,None,None)
     
     @property
     def origin_image_pos(self) -> RoombaPosition:
-        return self._map_coord_to_image_coord(self.roomba.zero_coords())
+        #the origin only moves when the map does, so translate it once
+        if self._origin_image_pos is None:
+            self._origin_image_pos = self._map_coord_to_image_coord(self.roomba.zero_coords())
+        return self._origin_image_pos
+
+    @property
+    def font(self) -> ImageFont.ImageFont:
+        if self._font is None:
+            try:
+                self._font = ImageFont.truetype(get_mapper_asset(self.assets_path, "monaco.ttf"), 30)
+            except Exception as e:
+                self.log.warning(f"Error loading font, loading default font")
+                self._font = ImageFont.load_default()
+        return self._font
+
+    @font.setter
+    def font(self, value: ImageFont.ImageFont):
+        self._font = value
+        self._text_cache = {}
 
     @property
     def min_coords(self) -> Tuple[int,int]:
 
-        if len(self._history) > 0:
-            return (
-                min(list(map(lambda p: p["x"], self._history))), 
-                min(list(map(lambda p: p["y"], self._history)))
-            )
+        if self._history_len > 0:
+            x, y = self._history_xy[:self._history_len].min(axis=0)
+            return (int(x), int(y))
         else:
             return (0,0)
 
     @property
     def max_coords(self) -> Tuple[int,int]:
-        if len(self._history) > 0:
-            return (
-                max(list(map(lambda p: p["x"], self._history))), 
-                max(list(map(lambda p: p["y"], self._history)))
-            )
+        if self._history_len > 0:
+            x, y = self._history_xy[:self._history_len].max(axis=0)
+            return (int(x), int(y))
         else:
             return (0,0)      
 
@@ -150,6 +230,26 @@ class RoombaMapper:
             self.log.error("Icon sets must have names")
             return
 
+        self._icons.pop(name, None)
+        self._icon_set_factories[name] = functools.partial(
+            self._create_icon_set, icon_path, home_icon, roomba_icon, 
+            error_icon, cancelled_icon, battery_low_icon, charging_icon, 
+            bin_full_icon, tank_low_icon, icon_size, show_direction
+        )
+
+    def _create_icon_set(self,
+        icon_path: str,
+        home_icon,
+        roomba_icon,
+        error_icon,
+        cancelled_icon,
+        battery_low_icon,
+        charging_icon,
+        bin_full_icon,
+        tank_low_icon,
+        icon_size,
+        show_direction
+    ) -> RoombaIconSet:
         i = RoombaIconSet(size=icon_size, show_direction=show_direction, log=self.log)
 
         if roomba_icon:
@@ -169,7 +269,14 @@ class RoombaMapper:
         if home_icon:
             i.home = self._get_mapper_asset(icon_path, home_icon)
 
-        self._icons[name] = i
+        return i
+
+    def _get_named_icon_set(self, name: str) -> RoombaIconSet:
+        icon_set = self._icons.get(name)
+        if icon_set is None and name in self._icon_set_factories:
+            icon_set = self._icon_set_factories[name]()
+            self._icons[name] = icon_set
+        return icon_set
 
     def add_map_device(self, name: str, device: RoombaMapDevice):
         if not name:
@@ -187,15 +294,16 @@ class RoombaMapper:
             return None
 
     def reset_map(self, map: RoombaMap, device: RoombaMapDevice = None, points_to_skip: int = DEFAULT_MAP_SKIP_POINTS):
-        self.map_enabled = self.roomba.cap.get("pose", False) and HAVE_PIL        
-        self._history = []
-        self._history_translated = []
-        self._map = map
-        self._device = device
-        self._points_to_skip = points_to_skip
-        self._points_skipped = 0
+        with self._lock:
+            self.map_enabled = self.roomba.cap.get("pose", False) and HAVE_PIL        
+            self._cancel_render()
+            self._clear_history()
+            self._map = map
+            self._device = device
+            self._points_to_skip = points_to_skip
+            self._points_skipped = 0
 
-        self._initialize_map()
+            self._initialize_map()
 
     def _initialize_map(self):
         self._render_params = self._get_render_parameters()
@@ -204,19 +312,47 @@ class RoombaMapper:
         if not self._map:
             self._map = RoombaMap("default",None)
 
-        #generate the base on which other layers will be composed
-        base = self._map_blank_image(color=self._render_params.bg_color)
-
-        #add the floorplan if available
-        if self._map and self._map.floorplan:
-            base = Image.alpha_composite(base, self._map.floorplan)
+        #the background, floorplan and walls only change with the map, so 
+        #they're only composed again when it does
+        static_key = (self._map, self._map.floorplan, self._map.walls, self._render_params.bg_color)
+        if static_key != self._static_key:
+            #generate the base on which other layers will be composed
+            base = self._map_blank_image(color=self._render_params.bg_color)
+
+            #add the floorplan if available (opaque ones can just be pasted)
+            self._floorplan_opaque = is_opaque(self._map.floorplan)
+            self._walls_opaque = is_opaque(self._map.walls)
+            if self._map and self._map.floorplan:
+                if self._floorplan_opaque:
+                    base.paste(self._map.floorplan)
+                else:
+                    base = Image.alpha_composite(base, self._map.floorplan)
+
+            #the walls go over the path, so they're kept separately as well
+            if self._map.walls and self._walls_opaque:
+                self._static_layer = self._map.walls.copy()
+            elif self._map.walls:
+                self._static_layer = Image.alpha_composite(base, self._map.walls)
+            else:
+                self._static_layer = base
+
+            self._base_rendered_map = base
+            self._static_key = static_key
 
         #set our internal variables so that we can get the default
-        self._base_rendered_map = base
-        self._rendered_map = base
+        self._rendered_map = self._base_rendered_map
+        self._last_render_sig = None
+        self._origin_image_pos = None
+        self._dock_pos = None
+        self._dock_icon = None
+        self._text_cache = {}
+        self._reset_path_layer()
     
     def update_map(self, force_redraw = False):
-        """Updates the cleaning map"""
+        """Updates the cleaning map, the map itself is rendered in the 
+        background so use wait_for_render if the next get_map has to include
+        this update. A forced redraw re-translates the whole history on the
+        calling thread, but never waits for a render that is in progress"""
 
         #if mapping not enabled, nothing to update
         if not self.map_enabled:
@@ -227,10 +363,94 @@ class RoombaMapper:
 
             #make sure we have phase info before trying to render
             if self.roomba.current_state is not None:
+                #appending to the history is safe while a render is running,
+                #a rebuild swaps in new arrays and the render redraws the path
                 self._update_state()
-                self._render_map()
+                if force_redraw:
+                    self._rebuild_translated_history()
+                self._schedule_render(force_redraw)
+
+    def wait_for_render(self, timeout: float = None):
+        """Waits until any queued render has finished, so that get_map 
+        includes every update so far. Raises the render's error if it 
+        failed, or TimeoutError if it hasn't finished within timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._render_lock:
+                future = self._render_future
+            if future is None:
+                return
+
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                future.result(remaining)
+            except CancelledError:
+                pass
+
+            #a forced redraw may have replaced the render while we waited
+            with self._render_lock:
+                if self._render_future is future:
+                    return
+
+    def _schedule_render(self, force_redraw = False):
+        """Queues a render on the render worker, unless one is already waiting 
+        to start, in which case it will pick up this update as well"""
+        with self._render_lock:
+            if self._render_pending and not force_redraw:
+                return
+
+            #a forced redraw replaces the render that is waiting to start
+            if self._render_future:
+                self._render_future.cancel()
+            self._render_generation += 1
+            self._render_pending = True
+            if self._render_executor is None:
+                self._render_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="roomba_mapper")
+            self._render_future = self._render_executor.submit(
+                self._delayed_render, self._render_generation, force_redraw)
+
+    def _delayed_render(self, generation: int, force_redraw = False):
+        """Renders the map, first waiting out the minimum render interval so
+        that bursts of updates only get rendered once"""
+        wait = self._last_render_time + DEFAULT_MAP_MIN_RENDER_INTERVAL - time.monotonic()
+        if wait > 0 and not force_redraw:
+            time.sleep(wait)
+
+        with self._lock:
+            with self._render_lock:
+                #skip renders that were replaced or cancelled while waiting
+                if generation != self._render_generation:
+                    return
+                self._render_pending = False
+
+            try:
+                self._render_map(force_redraw)
+            except Exception:
+                #the error is also kept on the future for wait_for_render
+                self.log.exception("Error rendering map")
+                raise
+
+    def _cancel_render(self):
+        with self._render_lock:
+            if self._render_future:
+                self._render_future.cancel()
+                self._render_future = None
+            self._render_pending = False
+            self._render_generation += 1
+
+    def close(self):
+        """Cancels any render that is waiting to start and stops the render 
+        worker, a later update starts a new one"""
+        self._cancel_render()
+        with self._render_lock:
+            executor, self._render_executor = self._render_executor, None
+        if executor:
+            executor.shutdown(wait=False)
 
     def get_map(self, width: int = None, height: int = None) -> bytes:
+        """Gets the last rendered map encoded as image_format (PNG or WEBP), 
+        renders run in the background so call wait_for_render first if the 
+        map has to include the latest update"""
 
         #get the default map
         map = self._rendered_map
@@ -239,15 +459,28 @@ class RoombaMapper:
         if map is None:
             return None
 
+        #if nothing was rendered since the last request, reuse the encoded 
+        #image (compare by identity, comparing images compares their pixels)
+        if self._encoded_map:
+            (last_map, last_width, last_height), encoded = self._encoded_map
+            if last_map is map and last_width == width and last_height == height:
+                return encoded
+        key = (map, width, height)
+
         #if we have a requested size, resize it
         if width and height:
             map = map.resize((width,height))
             pass 
 
-        #save the internal image
+        #save the internal image, favoring encode speed over size since 
+        #this runs for every update
         with io.BytesIO() as stream:
-            map.save(stream, format="PNG")
-            return stream.getvalue()
+            if self.image_format == "WEBP":
+                map.save(stream, format="WEBP", quality=DEFAULT_MAP_WEBP_QUALITY, method=0)
+            else:
+                map.save(stream, format="PNG", compress_level=DEFAULT_MAP_PNG_COMPRESS_LEVEL, optimize=False)
+            self._encoded_map = (key, stream.getvalue())
+            return self._encoded_map[1]
 
     def _update_state(self):
         position: dict[str,int] = None
@@ -255,9 +488,11 @@ class RoombaMapper:
         if self.roomba.changed('pose'):
             position = self.roomba.co_ords
         
-        self.log.debug(f"MAP [State Update]: co-ords: {self.roomba.co_ords} \
-                        phase: {self.roomba.phase}, \
-                        state: {self.roomba.current_state}")
+        #skip building the message for every pose when it won't be logged
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug(f"MAP [State Update]: co-ords: {self.roomba.co_ords} \
+                            phase: {self.roomba.phase}, \
+                            state: {self.roomba.current_state}")
 
         if self.roomba.current_state == ROOMBA_STATES["charge"]:
             position = None
@@ -278,90 +513,183 @@ class RoombaMapper:
                 self._points_skipped += 1
                 return
 
-            #if we have history, we need to check a couple things
-            if len(self._history) > 0:
-                old = self._history[-1]
-                old_x = old["x"]
-                old_y = old["y"]
-                new_x = position["x"]
-                new_y = position["y"]
+            #check it against the last point in the history and translate it
+            #to the image in one go
+            n = self._history_len
+            old_x, old_y = self._history_xy[n-1].tolist() if n > 0 else (0.0, 0.0)
+            keep, img_x, img_y, img_theta = process_pose(
+                n > 0, old_x, old_y, 
+                float(position["x"]), float(position["y"]), float(position["theta"]), 
+                float(self._max_distance), 
+                *self._map.transform
+            )
+            if not keep:
+                return
 
-                #if we didn't actually move from the last recorded position, ignore it
-                if (old_x,old_y) == (new_x,new_y):
-                    return
+            self._append_pose(position["x"], position["y"], position["theta"])
+            self._append_image_pos(RoombaPosition(img_x, img_y, img_theta))
 
-                #at times, roomba reports erroneous points, ignore if too large of a gap
-                #between measurements
-                if self._map_distance((old_x,old_y),(new_x,new_y)) > self._max_distance:
-                    return
+    def _clear_history(self):
+        self._history_len = 0
+        self._history_img_len = 0
+
+        #without PIL or numpy maps are disabled, so there's no history to keep
+        if not HAVE_PIL:
+            self._history_xy = self._history_theta = None
+            self._history_img_xy = self._history_img_theta = None
+            return
 
-            self._history.append(position)
-            self._history_translated.append(self._map_coord_to_image_coord(position))
+        #the raw and translated positions are kept as separate x,y and theta
+        #arrays, which grow by doubling so appends are amortized O(1)
+        self._history_xy = np.empty((DEFAULT_MAP_HISTORY_CAPACITY,2), dtype=np.float32)
+        self._history_theta = np.empty(DEFAULT_MAP_HISTORY_CAPACITY, dtype=np.float32)
+        self._history_img_xy = np.empty((DEFAULT_MAP_HISTORY_CAPACITY,2), dtype=np.int32)
+        self._history_img_theta = np.empty(DEFAULT_MAP_HISTORY_CAPACITY, dtype=np.int32)
+
+    def _append_pose(self, x, y, theta):
+        n = self._history_len
+        if n == len(self._history_theta):
+            self._history_xy = np.resize(self._history_xy, (2*n,2))
+            self._history_theta = np.resize(self._history_theta, 2*n)
+
+        self._history_xy[n] = (x, y)
+        self._history_theta[n] = theta
+        self._history_len += 1
+
+    def _append_image_pos(self, pos: RoombaPosition):
+        n = self._history_img_len
+
+        #if we're still on the same pixel, the path doesn't change, only the 
+        #direction the roomba is facing
+        if n > 0 and self._history_img_xy[n-1].tolist() == [pos.x, pos.y]:
+            self._history_img_theta[n-1] = pos.theta
+            return
+
+        if n == len(self._history_img_theta):
+            self._history_img_xy = np.resize(self._history_img_xy, (2*n,2))
+            self._history_img_theta = np.resize(self._history_img_theta, 2*n)
+
+        self._history_img_xy[n] = (pos.x, pos.y)
+        self._history_img_theta[n] = pos.theta
+        self._history_img_len += 1
+
+    def _rebuild_translated_history(self):
+        """Re-validates and translates the whole history in one vectorized pass"""
+        if self._history_len == 0:
+            with self._render_lock:
+                self._history_img_len = 0
+                self._path_stale = True
+            return
+
+        xy = self._history_xy[:self._history_len]
+        theta = self._history_theta[:self._history_len]
+
+        #same checks as _update_state: drop points where we didn't move, or
+        #that are too far from the previous point to be believable
+        d2 = np.sum(np.diff(xy, axis=0)**2, axis=1)
+        keep = np.concatenate(([True], (d2 > 0) & (d2 <= self._max_distance**2)))
+
+        img_xy, img_theta = self._batch_translate(xy[keep], theta[keep])
+
+        #the path layer is reset by the next render, so that this doesn't
+        #have to wait for one that is in progress
+        with self._render_lock:
+            self._history_img_xy, self._history_img_theta = img_xy, img_theta
+            self._history_img_len = len(img_theta)
+            self._path_stale = True
 
     def _map_coord_to_image_coord(self, coord: dict) -> RoombaPosition:
-        x: float = float(coord["x"])
-        y: float = float(coord["y"])
-        theta: float = float(coord["theta"])
-        
-        #perform rotation: occurs about the map origin, so should
-        #undo any rotation that exists
-        x, y = rotate(x, y, self._map.angle,
-            invert_x = self._map.coords_start[0] > self._map.coords_end[0],
-            invert_y = self._map.coords_start[1] < self._map.coords_end[1]
-        )
+        #the rotation and scaling are fixed per map, so are precomputed
+        t = self._map.transform
+
+        return RoombaPosition(*translate_pose(
+            float(coord["x"]), float(coord["y"]), float(coord["theta"]), *t
+        ))
+
+    def _batch_translate(self, xy: 'np.ndarray', theta: 'np.ndarray') -> Tuple['np.ndarray','np.ndarray']:
+        """Vectorized _map_coord_to_image_coord for arrays of x,y and theta"""
+        t = self._map.transform
+
+        #the compiled kernel does it in one pass without any temporary arrays
+        if HAVE_NUMBA:
+            img_xy = np.empty((len(xy), 2), dtype=np.int32)
+            img_theta = np.empty(len(theta), dtype=np.int32)
+            translate_poses(
+                img_xy, img_theta, 
+                np.ascontiguousarray(xy, dtype=float), 
+                np.ascontiguousarray(theta, dtype=float), 
+                *t
+            )
+            return img_xy, img_theta
 
-        #interpolate the x,y coordinates to scale to the appropriate output
-        img_x = interpolate(
-            x, 
-            [self._map.coords_start[0], self._map.coords_end[0]],
-            [0, self._map.img_width - 1]
-        )
-        img_y = interpolate(
-            y, 
-            [self._map.coords_start[1], self._map.coords_end[1]],
-            [0, self._map.img_height - 1]
-        )
+        xy = xy.astype(float)
 
-        #make sure we stay within the bounds
-        clamp(img_x, 0, self._map.img_width)
-        clamp(img_y, 0, self._map.img_height)
-        
-        #adjust theta
-        #from what I can see, it looks like the roomba uses a coordinate system:
-        #0 = facing away from the dock, increasing angle counter-clockwise
-        #it looks like past 180, the roomba uses negative angles, but still seems
-        #to be in the counter-clockwise direction
-        #PIL denotes angles in the counterclockwise direction
-        #so, to compute the right angle, we need to:
-        #1) add map angle
-        #2) add 180 degrees (roomba image faces up, but should face away at 0)
-        #2) add theta
-        #3) mod 360, add 360 if negative
-        img_theta = (self._map.angle + theta + 180) % 360
-        if img_theta < 0:
-            img_theta += 360        
-        
-        #return the tuple
-        return RoombaPosition(int(img_x), int(img_y), int(img_theta))
+        #rotate everything with a single matrix multiply
+        rotation = np.array(((t.cos, -t.sin), (t.sin, t.cos)))
+        rotated = np.dot(xy, rotation.T)
+        if t.invert_x:
+            rotated[:,0] = xy[:,0] - (rotated[:,0] - xy[:,0])
+        if t.invert_y:
+            rotated[:,1] = xy[:,1] - (rotated[:,1] - xy[:,1])
+
+        #then clamp and scale to the image
+        low = (t.min_x, t.min_y)
+        np.clip(rotated, low, (t.max_x, t.max_y), out=rotated)
+        rotated -= low
+        rotated /= (t.max_x - t.min_x, t.max_y - t.min_y)
+        img_xy = (t.offset_x, t.offset_y) + rotated * (t.scale_x, t.scale_y)
 
-    def _render_map(self):
+        #np.mod follows the sign of the divisor, so this is always positive
+        img_theta = np.mod(t.angle + theta.astype(float) + 180, 360)
+
+        return img_xy.astype(np.int32), img_theta.astype(np.int32)
+
+    def _render_map(self, force_redraw = False):
         """Renders the map"""
 
-        #draw in the vacuum path
-        base = self._draw_vacuum_path(self._base_rendered_map)
+        #take a snapshot of the flags, they can change while we're rendering
+        flags = dict(self.roomba.flags)
 
-        #draw in the map walls (to hide overspray)
-        if self._map.walls:
-            base = Image.alpha_composite(base, self._map.walls)
+        #if nothing visible changed since the last render, keep the last image
+        sig = self._get_render_signature(flags)
+        if sig == self._last_render_sig and not force_redraw:
+            return
+
+        #redraw the whole path if the history was rebuilt since the last render
+        with self._render_lock:
+            reset_path, self._path_stale = self._path_stale, False
+        if reset_path:
+            self._reset_path_layer()
+
+        #draw any new parts of the vacuum path, this also updates the map 
+        #layer (base, path and walls) where the path changed
+        self._draw_vacuum_path()
+        if self._get_icon_set().home is not self._map_layer_dock:
+            self._map_layer = self._compose_map_layer()
+
+        #everything else is composited in place, only over the area it covers,
+        #so this is the only full frame copy (it leaves the map layer alone)
+        base = self._map_layer.copy()
 
         #draw the roomba and any problems
-        base = self._draw_roomba(base)
+        base = self._draw_roomba(base, flags)
 
         #finally, draw the text
         #base = self._draw_text(base)
 
         #save the map
         self._rendered_map = base
+        self._last_render_sig = sig
+        self._last_render_time = time.monotonic()
+
+    def _get_render_signature(self, flags: dict) -> tuple:
+        """Gets a tuple of everything that affects the rendered image"""
+        return (
+            self._history_img_len,
+            self.roomba_image_pos,
+            self.roomba.current_state,
+            tuple(sorted(flags.items()))
+        )
         
     def _get_render_parameters(self) -> MapRenderParameters:
         if self._map:
@@ -370,7 +698,7 @@ class RoombaMapper:
             path_color = self._map.path_color
             path_width = self._map.path_width
         else:
-            icon_set = self._get_icon_set()
+            icon_set = None
             bg_color = DEFAULT_BG_COLOR
             path_color = DEFAULT_PATH_COLOR
             path_width = DEFAULT_PATH_WIDTH
@@ -403,44 +731,135 @@ class RoombaMapper:
     def _map_blank_image(self, color=transparent) -> Image.Image:
         return make_blank_image(self._map.img_width,self._map.img_height,color)
 
-    def _draw_vacuum_path(self, base: Image.Image) -> Image.Image:
-        if len(self._history_translated) > 1:        
-            layer = self._map_blank_image()
-            renderer = ImageDraw.Draw(layer)
+    def _reset_path_layer(self):
+        """Clears the path so it is redrawn in full on the next render"""
+        self._path_layer = self._map_blank_image()
+        self._path_drawn = 0
 
-            renderer.line(
-                list(map(lambda p: (p.x,p.y), self._history_translated)),
-                fill=self._render_params.path_color,
-                width=self._render_params.path_width,
-                joint="curve"
-            )
+        #without a path, the map layer is just the static layers and the dock
+        self._map_layer = self._static_layer.copy()
+        self._composite_dock(self._map_layer)
+
+    def _compose_map_layer(self, box: Tuple[int,int,int,int] = None, dock: bool = True) -> Image.Image:
+        """Composes the base, path, walls and dock, either fully or just within box"""
+        def region(image: Image.Image) -> Image.Image:
+            return image.crop(box) if box else image.copy()
 
-            return Image.alpha_composite(base, layer)
+        #draw in the map walls (to hide overspray)
+        if self._map.walls and self._walls_opaque:
+            layer = region(self._map.walls)
         else:
-            return base
+            layer = Image.alpha_composite(region(self._base_rendered_map), region(self._path_layer))
+            if self._map.walls:
+                layer = Image.alpha_composite(layer, region(self._map.walls))
+
+        if dock:
+            self._composite_dock(layer, box)
+
+        return layer
+
+    def _composite_dock(self, layer: Image.Image, box: Tuple[int,int,int,int] = None):
+        """The dock never moves, so it is part of the map layer as well"""
+        icon_set = self._get_icon_set()
+        self._map_layer_dock = icon_set.home
+        self._composite_clipped(layer, icon_set.home, self._get_dock_pos(icon_set), box)
+
+    def _composite_clipped(self, layer: Image.Image, icon: Image.Image, pos: Tuple[int,int], box: Tuple[int,int,int,int] = None):
+        """Composites icon at pos (in map coordinates) onto layer, which covers
+        box of the map, clipping it to whatever part of it is in the layer"""
+        bx, by = (box[0], box[1]) if box else (0, 0)
+        x0 = max(pos[0], bx)
+        y0 = max(pos[1], by)
+        x1 = min(pos[0] + icon.size[0], bx + layer.size[0])
+        y1 = min(pos[1] + icon.size[1], by + layer.size[1])
+        if x0 >= x1 or y0 >= y1:
+            return
+        layer.alpha_composite(
+            icon, 
+            dest=(x0 - bx, y0 - by), 
+            source=(x0 - pos[0], y0 - pos[1], x1 - pos[0], y1 - pos[1])
+        )
+
+    def _draw_vacuum_path(self):
+        n = self._history_img_len
+
+        #only draw the segments added since the last render, starting a point
+        #earlier so that the joint at the previous end is drawn as well
+        start = max(self._path_drawn - 2, 0)
+        points = self._history_img_xy[start:n]
+        self._path_drawn = n
+        if len(points) < 2:
+            return
+
+        renderer = ImageDraw.Draw(self._path_layer)
+
+        #PIL takes a flat x0,y0,x1,y1... sequence, no need for tuples
+        renderer.line(
+            points.reshape(-1).tolist(),
+            fill=self._render_params.path_color,
+            width=self._render_params.path_width,
+            joint="curve"
+        )
+
+        #recompose the map layer, but only where the new segments are
+        margin = self._render_params.path_width + 1
+        x0, y0 = points.min(axis=0) - margin
+        x1, y1 = points.max(axis=0) + margin + 1
+        box = (
+            int(clamp(x0, 0, self._map.img_width)),
+            int(clamp(y0, 0, self._map.img_height)),
+            int(clamp(x1, 0, self._map.img_width)),
+            int(clamp(y1, 0, self._map.img_height))
+        )
+        self._map_layer.paste(self._compose_map_layer(box), box)
 
     def _get_icon_set(self):
         #get the default (should always exist)
-        icon_set = self._icons["default"]
+        icon_set = self._get_named_icon_set("default")
 
         #attempt to get the series specific set
         if self.roomba and self.roomba.sku:
-            series = self._icons.get(self.roomba.sku[0],None)            
+            series = self._get_named_icon_set(self.roomba.sku[0])
             if series:
                 icon_set = series
 
         #override with the map set if needed
         if self._render_params and self._render_params.icon_set:
-            try:
-                icon_set = self._icons[self._render_params.icon_set]
-            except:
+            map_set = self._get_named_icon_set(self._render_params.icon_set)
+            if map_set:
+                icon_set = map_set
+            else:
                 self.log.warn(f"Could not load icon set '{self._render_params.icon_set}' for map.")
 
         return icon_set
 
-    def _draw_roomba(self, base: Image.Image) -> Image.Image:
-        layer = self._map_blank_image()
+    def _get_dock_pos(self, icon_set: RoombaIconSet) -> Tuple[int,int]:
+        """Gets the position of the dock icon, which is fixed for a given map"""
+        if self._dock_pos is None or self._dock_icon is not icon_set.home:
+            self._dock_pos = center_image(
+                self.origin_image_pos.x, 
+                self.origin_image_pos.y, 
+                icon_set.home, 
+                (self._map.img_width, self._map.img_height)
+            )
+            self._dock_icon = icon_set.home
+
+        return self._dock_pos
+
+    def _get_problem_icon(self, icon_set: RoombaIconSet, flags: dict) -> Image.Image:
+        """Gets the icon for the highest priority problem flag, if any"""
+        key = (icon_set, tuple(flags.items()))
+        if key != self._problem_icon_key:
+            self._problem_icon = next(
+                (getattr(icon_set, icon) for flag, icon in self._PROBLEM_ICONS 
+                    if flags.get(flag)), 
+                None
+            )
+            self._problem_icon_key = key
 
+        return self._problem_icon
+
+    def _draw_roomba(self, base: Image.Image, flags: dict) -> Image.Image:
         #get the image coordinates of the roomba
         x, y, theta = self.roomba_image_pos
 
@@ -449,124 +868,140 @@ class RoombaMapper:
 
         #add in the roomba icon
         if x and y:
-            rotated = icon_set.roomba.rotate(theta, expand=True)
-            layer.paste(rotated, center_image(x, y, rotated, layer.size))
-
-        #add the dock
-        dock = self._map_blank_image()
-        dock.paste(
-            icon_set.home,
-            center_image(
-                self.origin_image_pos.x, 
-                self.origin_image_pos.y, 
-                icon_set.home, layer.size
-            )
-        )
-
-        layer = Image.alpha_composite(layer, dock)
+            rotated = icon_set.rotated_roomba(theta)
+            pos = center_image(x, y, rotated, base.size)
+
+            #the dock is already in the map layer, but has to stay on top of 
+            #the roomba, so if they overlap, take it out and add it back after
+            dx, dy = self._get_dock_pos(icon_set)
+            dw, dh = icon_set.home.size
+            if (pos[0] < dx + dw and dx < pos[0] + rotated.size[0] and
+                pos[1] < dy + dh and dy < pos[1] + rotated.size[1]):
+                box = (dx, dy, min(dx + dw, base.size[0]), min(dy + dh, base.size[1]))
+                base.paste(self._compose_map_layer(box, dock=False), box)
+                base.alpha_composite(rotated, pos)
+                self._composite_clipped(base, icon_set.home, (dx, dy))
+            else:
+                base.alpha_composite(rotated, pos)
 
         #add the problem icon (pick one in a priority order)
-        problem_icon = None
-        if self.roomba.flags.get('stuck'):
-            problem_icon = icon_set.error
-        elif self.roomba.flags.get('cancelled'):
-            problem_icon = icon_set.cancelled
-        elif self.roomba.flags.get('bin_full'):
-            problem_icon = icon_set.bin_full
-        elif self.roomba.flags.get('battery_low'):
-            problem_icon = icon_set.battery_low
-        elif self.roomba.flags.get('tank_low'):
-            problem_icon = icon_set.tank_low
+        problem_icon = self._get_problem_icon(icon_set, flags)
 
         if x and y and problem_icon:
-            problem = self._map_blank_image()
-            problem.paste(
+            base.alpha_composite(
                 problem_icon,
-                center_image(x, y, problem_icon, layer.size)             
+                center_image(x, y, problem_icon, base.size)
             )
-            layer = Image.alpha_composite(layer, problem)
 
-        return Image.alpha_composite(base, layer)
+        return base
 
     def _draw_text(self, base: Image.Image) -> Image.Image:
         margin = 10
 
-        layer = self._map_blank_image()
         state, attributes, time = self._get_display_text()
-        renderer = ImageDraw.Draw(layer)
 
+        #the text box only depends on the text and its colors, so reuse it 
+        #when we can, which skips the wrapping and layout completely
+        key = (state, attributes, time, self._map.text_color, self._map.text_bg_color)
+        text_image = self._text_cache.get(key)
+        if text_image is None:
+            text_image = self._render_text(
+                self._format_text(state, attributes, time, base.size[0]-2*margin),
+                margin
+            )
+            if len(self._text_cache) >= DEFAULT_TEXT_CACHE_SIZE:
+                #dicts keep insertion order, so this drops the oldest entry
+                del self._text_cache[next(iter(self._text_cache))]
+            self._text_cache[key] = text_image
+
+        base.alpha_composite(text_image)
+        return base
+
+    def _format_text(self, state: str, attributes: str, time: str, width: int) -> str:
         #consider something like pynter, perhaps would look better
 
         combined_text = state.upper()
         if attributes:
-            max_len = (base.size[0]-2*margin)//(self.font.getsize(attributes)[0]//len(attributes))
+            #use a single wide character as the width estimate, it only depends
+            #on the font
+            max_len = int(width//get_text_width(self.font, "M"))
             attributes = textwrap.fill(attributes, max_len)
             combined_text = combined_text + "\n" + attributes
         if time:
             combined_text = combined_text + "\n" + "Time: " + time            
-        
+
+        return combined_text
+
+    def _render_text(self, text: str, margin: int) -> Image.Image:
+        """Renders the text box into an image just large enough to hold it"""
+
         #get the bounding box
-        bbox = renderer.multiline_textbbox((margin,margin), combined_text, self.font)
+        renderer = ImageDraw.Draw(make_blank_image(1, 1))
+        bbox = renderer.multiline_textbbox((margin,margin), text, self.font)
         bbox = (bbox[0]-margin,bbox[1]-margin,bbox[2]+margin,bbox[3]+margin)
 
+        layer = make_blank_image(bbox[2]+1, bbox[3]+1)
+        renderer = ImageDraw.Draw(layer)
+
         #render a background box
         renderer.rectangle(bbox, fill=self._map.text_bg_color)
 
         #render the text
-        renderer.multiline_text((margin,margin), combined_text, fill=self._map.text_color, font=self.font)
+        renderer.multiline_text((margin,margin), text, fill=self._map.text_color, font=self.font)
 
-        return Image.alpha_composite(base, layer)
+        return layer
 
     def _get_display_text(self) -> Tuple[str,str,str]:
         display_state: str = None
         display_attributes: str = None
         display_time: str = None
         show_time: bool = False
+        state = self.roomba.current_state
 
-        if  self.roomba.current_state == ROOMBA_STATES["charge"]:
+        if  state == ROOMBA_STATES["charge"]:
             display_state = "Charging"
             display_attributes = f"Battery: {self.roomba.batPct}%"
-        elif self.roomba.current_state == ROOMBA_STATES["recharge"]:
+        elif state == ROOMBA_STATES["recharge"]:
             display_state = "Recharging"
             display_attributes = f"Time: {self.roomba.rechrgM}m, \
                              Bat: {self.roomba.batPct}%"
-        elif self.roomba.current_state == ROOMBA_STATES["pause"]:
+        elif state == ROOMBA_STATES["pause"]:
             display_state = "Paused"
             display_attributes = f"{self.roomba.mssnM}m, \
                              Bat: {self.roomba.batPct}%"
-        elif self.roomba.current_state == ROOMBA_STATES["hmPostMsn"]:
+        elif state == ROOMBA_STATES["hmPostMsn"]:
             display_state = "Returning Home"
             show_time = True
-        elif self.roomba.current_state == ROOMBA_STATES["evac"]:
+        elif state == ROOMBA_STATES["evac"]:
             display_state = "Emptying Bin"
-        elif self.roomba.current_state == ROOMBA_STATES["completed"]:
+        elif state == ROOMBA_STATES["completed"]:
             display_state = "Completed"
             show_time = True            
-        elif self.roomba.current_state == ROOMBA_STATES["run"]:
+        elif state == ROOMBA_STATES["run"]:
             display_state = "Running"
             display_attributes = f"Time {self.roomba.mssnM}m, Bat: {self.roomba.batPct}%"
-        elif self.roomba.current_state == ROOMBA_STATES["stop"]:
+        elif state == ROOMBA_STATES["stop"]:
             display_state = "Stopped"
             display_attributes = f"Time {self.roomba.mssnM}m, Bat: {self.roomba.batPct}%"
-        elif self.roomba.current_state == ROOMBA_STATES["new"]:
+        elif state == ROOMBA_STATES["new"]:
             display_state = "Starting"
-        elif self.roomba.current_state == ROOMBA_STATES["stuck"]:
+        elif state == ROOMBA_STATES["stuck"]:
             expire = self.roomba.expireM
             expire_text = f'Job Cancel in {expire}m' if expire else 'Job Cancelled'
             display_state = "Stuck"
             display_attributes = f"{self.roomba.error_message} {expire_text}"
             show_time = True
-        elif self.roomba.current_state == ROOMBA_STATES["cancelled"]:
+        elif state == ROOMBA_STATES["cancelled"]:
             display_state = "Cancelled"
             show_time = True
-        elif self.roomba.current_state == ROOMBA_STATES["hmMidMsn"]:
+        elif state == ROOMBA_STATES["hmMidMsn"]:
             display_state = "Docking"
             display_attributes = f"Bat: {self.roomba.batPct}%, Bin Full: {self.roomba.bin_full}"
-        elif self.roomba.current_state == ROOMBA_STATES["hmUsrDock"]:
+        elif state == ROOMBA_STATES["hmUsrDock"]:
             display_state = "User Docking"
             show_time = True
         else:
-            display_state = self.roomba.current_state
+            display_state = state
         
         if show_time:
             display_time = time.strftime("%a %b %d %H:%M:%S")
@@ -574,9 +1009,12 @@ class RoombaMapper:
         return display_state, display_attributes, display_time    
 
     def _map_distance(self, pos1: 'Tuple[int,int]', pos2: 'Tuple[int,int]'):
-        return int(math.sqrt(((pos2[0]-pos1[0])**2)+((pos2[1]-pos1[1])**2)))  
-
-    def _interpolate_path_color(f_co, t_co, interval):
-        det_co =[(t - f) / interval for f , t in zip(f_co, t_co)]
-        for i in range(interval):
-            yield [round(f + det * i) for f, det in zip(f_co, det_co)]  
\ No newline at end of file
+        return int(math.sqrt(distance_sq(pos1[0], pos1[1], pos2[0], pos2[1])))  
+
+    def _interpolate_path_color(self, f_co, t_co, interval) -> 'np.ndarray':
+        """Gets an (interval, channels) array of colors going from f_co 
+        towards t_co, not including t_co itself"""
+        f = np.asarray(f_co, dtype=np.float32)
+        t = np.asarray(t_co, dtype=np.float32)
+        steps = np.linspace(0, 1, interval, endpoint=False, dtype=np.float32)[:,None]
+        return np.round(f + (t - f) * steps).astype(np.uint8)  
\ No newline at end of file
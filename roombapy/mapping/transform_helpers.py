@@ -0,0 +1,110 @@
+from typing import Tuple
+
+# Import trickery
+global HAVE_NUMBA
+HAVE_NUMBA = False
+
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:
+    def njit(*args, **kwargs):
+        '''
+        stand in for numba.njit when numba isn't installed, the kernels
+        below are then plain python functions
+        '''
+        def decorator(func):
+            return func
+        return decorator
+
+@njit(cache=True)
+def translate_pose(
+    x: float, y: float, theta: float,
+    angle: float, cos: float, sin: float, invert_x: bool, invert_y: bool,
+    min_x: float, max_x: float, min_y: float, max_y: float,
+    scale_x: float, offset_x: float, scale_y: float, offset_y: float
+) -> Tuple[int,int,int]:
+    '''
+    translates a roomba pose to an image position, the map arguments are the
+    fields of a RoombaMapTransform, in order
+    '''
+
+    #perform rotation: occurs about the map origin, so should
+    #undo any rotation that exists
+    xx = x*cos - y*sin
+    yy = x*sin + y*cos
+    if invert_x:
+        xx = x - (xx - x)
+    if invert_y:
+        yy = y - (yy - y)
+
+    #scale the x,y coordinates to the appropriate output, keeping them
+    #within the map coordinates
+    img_x = offset_x + (max(min(xx, max_x), min_x) - min_x) / (max_x - min_x) * scale_x
+    img_y = offset_y + (max(min(yy, max_y), min_y) - min_y) / (max_y - min_y) * scale_y
+
+    #adjust theta
+    #from what I can see, it looks like the roomba uses a coordinate system:
+    #0 = facing away from the dock, increasing angle counter-clockwise
+    #it looks like past 180, the roomba uses negative angles, but still seems
+    #to be in the counter-clockwise direction
+    #PIL denotes angles in the counterclockwise direction
+    #so, to compute the right angle, we need to:
+    #1) add map angle
+    #2) add 180 degrees (roomba image faces up, but should face away at 0)
+    #2) add theta
+    #3) mod 360 (always positive, as the divisor is)
+    img_theta = (angle + theta + 180) % 360
+
+    return int(img_x), int(img_y), int(img_theta)
+
+@njit(cache=True)
+def translate_poses(
+    out_xy, out_theta, xy, theta,
+    angle: float, cos: float, sin: float, invert_x: bool, invert_y: bool,
+    min_x: float, max_x: float, min_y: float, max_y: float,
+    scale_x: float, offset_x: float, scale_y: float, offset_y: float
+):
+    '''
+    translate_pose for (n,2) x,y and (n,) theta arrays, written into the
+    out_xy and out_theta arrays. only worth using when compiled with numba
+    '''
+    for i in range(xy.shape[0]):
+        out_xy[i,0], out_xy[i,1], out_theta[i] = translate_pose(
+            xy[i,0], xy[i,1], theta[i],
+            angle, cos, sin, invert_x, invert_y,
+            min_x, max_x, min_y, max_y,
+            scale_x, offset_x, scale_y, offset_y
+        )
+
+@njit(cache=True)
+def process_pose(
+    has_old: bool, old_x: float, old_y: float,
+    x: float, y: float, theta: float, max_distance: float,
+    angle: float, cos: float, sin: float, invert_x: bool, invert_y: bool,
+    min_x: float, max_x: float, min_y: float, max_y: float,
+    scale_x: float, offset_x: float, scale_y: float, offset_y: float
+) -> Tuple[bool,int,int,int]:
+    '''
+    checks a new pose against the last one in the history and translates it,
+    returns whether to keep it along with its image position
+    '''
+    if has_old:
+        #if we didn't actually move from the last recorded position, ignore it
+        if old_x == x and old_y == y:
+            return False, 0, 0, 0
+
+        #at times, roomba reports erroneous points, ignore if too large of a gap
+        #between measurements (compared squared, to skip the sqrt)
+        dx = x - old_x
+        dy = y - old_y
+        if dx*dx + dy*dy > max_distance*max_distance:
+            return False, 0, 0, 0
+
+    img_x, img_y, img_theta = translate_pose(
+        x, y, theta,
+        angle, cos, sin, invert_x, invert_y,
+        min_x, max_x, min_y, max_y,
+        scale_x, offset_x, scale_y, offset_y
+    )
+    return True, img_x, img_y, img_theta
@@ -273,6 +273,7 @@ class Roomba:
         return is_connected
 
     def disconnect(self):
+        self._mapper.close()
         if self.continuous:
             self.remote_client.disconnect()
         else:
@@ -422,6 +423,10 @@ class Roomba:
     def get_map(self, width: int = None, height: int = None):
         return self._mapper.get_map(width,height)
 
+    def wait_for_map_render(self, timeout: float = None):
+        """Waits for the map to be rendered with the latest updates"""
+        self._mapper.wait_for_render(timeout)
+
     def dict_merge(self, dct, merge_dct):
         """
         Recursive dict merge.
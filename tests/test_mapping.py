@@ -0,0 +1,392 @@
+import math
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from roombapy.mapping import RoombaMap, RoombaMapper, roomba_mapper
+from roombapy.mapping.image_helpers import validate_color
+from roombapy.mapping import transform_helpers
+from roombapy.mapping.transform_helpers import translate_pose
+from tests import abstract_test_roomba
+
+
+class TestMapping(abstract_test_roomba.AbstractTestRoomba):
+    @staticmethod
+    def get_mapper(roomba_map=None):
+        roomba = TestMapping.get_default_roomba()
+        roomba.master_state = {"state": {"reported": {"cap": {"pose": 1}}}}
+        mapper = roomba._mapper
+        mapper.reset_map(roomba_map or RoombaMap("test", "Test"))
+        return mapper
+
+    @staticmethod
+    def record_renders(mapper):
+        renders = []
+        mapper._render_map = renders.append
+        # make the next render wait out the minimum render interval
+        mapper._last_render_time = time.monotonic()
+        return renders
+
+    @staticmethod
+    def use_kernels(monkeypatch, compiled):
+        """Runs the transform through the numba kernels, or through their
+        plain python versions and the numpy fallback"""
+        if compiled and not transform_helpers.HAVE_NUMBA:
+            pytest.skip("numba is not installed")
+        monkeypatch.setattr(roomba_mapper, "HAVE_NUMBA", compiled)
+        if not compiled:
+            for module in (roomba_mapper, transform_helpers):
+                for name in ("translate_pose", "process_pose"):
+                    kernel = getattr(module, name)
+                    monkeypatch.setattr(module, name, getattr(kernel, "py_func", kernel))
+
+    @pytest.mark.parametrize("compiled", [True, False])
+    def test_batch_translate_matches_single_point(self, monkeypatch, compiled):
+        # given
+        self.use_kernels(monkeypatch, compiled)
+        reference = getattr(translate_pose, "py_func", translate_pose)
+        mapper = self.get_mapper(
+            RoombaMap(
+                "test",
+                "Test",
+                coords_start=(800, -600),
+                coords_end=(-700, 900),
+                angle=33,
+            )
+        )
+        coords = np.array(
+            [[x, y, t] for x in range(-900, 901, 150)
+             for y in range(-700, 1001, 170)
+             for t in (-180, -45, 0, 90, 179)],
+            dtype=float,
+        )
+
+        # when
+        img_xy, img_theta = mapper._batch_translate(coords[:, :2], coords[:, 2])
+
+        # then
+        translated = np.column_stack((img_xy, img_theta))
+        for coord, pos in zip(coords, translated.tolist()):
+            expected = reference(*coord, *mapper._map.transform)
+            single = mapper._map_coord_to_image_coord(
+                {"x": coord[0], "y": coord[1], "theta": coord[2]}
+            )
+            assert tuple(pos) == tuple(single) == expected
+
+    @pytest.mark.parametrize("compiled", [True, False])
+    def test_transform_maps_clamped_edges_to_last_pixel(self, monkeypatch, compiled):
+        # given
+        self.use_kernels(monkeypatch, compiled)
+        mapper = self.get_mapper(
+            RoombaMap(
+                "test", "Test", coords_start=(-897, -897), coords_end=(897, 897)
+            )
+        )
+        coords = np.array(
+            [[897, 897, 0], [5000, 5000, 0], [-897, -897, 0], [-5000, -5000, 0]],
+            dtype=float,
+        )
+
+        # when
+        img_xy, _ = mapper._batch_translate(coords[:, :2], coords[:, 2])
+
+        # then
+        expected = [(999, 999), (999, 999), (0, 0), (0, 0)]
+        assert [tuple(pos) for pos in img_xy.tolist()] == expected
+        for coord, pos in zip(coords, expected):
+            single = mapper._map_coord_to_image_coord(
+                {"x": coord[0], "y": coord[1], "theta": coord[2]}
+            )
+            assert (single.x, single.y) == pos
+
+    def test_rebuild_translated_history_filters_points(self):
+        # given
+        mapper = self.get_mapper()
+        mapper._max_distance = 100
+        for x, y in [(0, 0), (10, 10), (10, 10), (20, 20), (900, 900)]:
+            mapper._append_pose(x, y, 0)
+
+        # when
+        mapper._rebuild_translated_history()
+
+        # then
+        assert mapper._history_img_len == 3
+
+    def test_min_max_coords(self):
+        # given
+        mapper = self.get_mapper()
+        for x, y in [(10, -5), (-20, 30), (5, 50)]:
+            mapper._append_pose(x, y, 0)
+
+        # when
+        min_coords = mapper.min_coords
+        max_coords = mapper.max_coords
+
+        # then
+        assert min_coords == (-20, -5)
+        assert max_coords == (10, 50)
+
+    def test_interpolate_path_color(self):
+        # given
+        mapper = self.get_mapper()
+
+        # when
+        colors = mapper._interpolate_path_color((0, 100, 200), (100, 100, 0), 4)
+
+        # then
+        assert colors.tolist() == [
+            [0, 100, 200], [25, 100, 150], [50, 100, 100], [75, 100, 50]
+        ]
+
+    def test_reset_map_recomputes_dock_position(self):
+        # given
+        mapper = self.get_mapper()
+        centered = mapper._get_dock_pos(mapper._get_icon_set())
+
+        # when
+        mapper.reset_map(
+            RoombaMap("test", "Test", coords_start=(0, 0), coords_end=(1000, 1000))
+        )
+
+        # then
+        assert mapper._get_dock_pos(mapper._get_icon_set()) != centered
+        assert (
+            mapper._map_layer.tobytes() == mapper._compose_map_layer().tobytes()
+        )
+
+    @pytest.mark.parametrize("compiled", [True, False])
+    def test_process_pose_filters_and_translates(self, monkeypatch, compiled):
+        # given
+        mapper = self.get_mapper()
+        transform = mapper._map.transform
+        self.use_kernels(monkeypatch, compiled)
+        kernel = roomba_mapper.process_pose
+
+        # when
+        first = kernel(False, 0.0, 0.0, 10.0, 20.0, 30.0, 100.0, *transform)
+        same = kernel(True, 10.0, 20.0, 10.0, 20.0, 30.0, 100.0, *transform)
+        far = kernel(True, 10.0, 20.0, 500.0, 20.0, 30.0, 100.0, *transform)
+
+        # then
+        expected = mapper._map_coord_to_image_coord({"x": 10, "y": 20, "theta": 30})
+        assert first == (True, *expected)
+        assert not same[0]
+        assert not far[0]
+
+    def test_get_map_reuses_encoded_image(self):
+        # given
+        mapper = self.get_mapper()
+        encoded = mapper.get_map()
+
+        # then
+        assert mapper.get_map() is encoded
+        mapper._rendered_map = mapper._rendered_map.copy()
+        assert mapper.get_map() is not encoded
+        assert mapper.get_map(100, 100) != encoded
+
+    def test_unsupported_image_format_falls_back_to_png(self):
+        roomba = self.get_default_roomba()
+
+        assert RoombaMapper(roomba, image_format="webp").image_format == "WEBP"
+        assert RoombaMapper(roomba, image_format="jpeg").image_format == "PNG"
+
+    def test_webp_falls_back_to_png_without_libwebp(self, monkeypatch):
+        # given
+        roomba = self.get_default_roomba()
+        monkeypatch.setattr(roomba_mapper.features, "check", lambda feature: False)
+
+        # when
+        mapper = RoombaMapper(roomba, image_format="webp")
+
+        # then
+        assert mapper.image_format == "PNG"
+
+    def test_render_coalesces_updates(self):
+        # given
+        mapper = self.get_mapper()
+        renders = self.record_renders(mapper)
+
+        # when
+        for _ in range(5):
+            mapper._schedule_render()
+        mapper.wait_for_render()
+
+        # then
+        assert renders == [False]
+
+    def test_forced_render_replaces_waiting_render(self):
+        # given
+        mapper = self.get_mapper()
+        renders = self.record_renders(mapper)
+
+        # when
+        mapper._schedule_render()
+        mapper._schedule_render(force_redraw=True)
+        mapper.wait_for_render()
+
+        # then
+        assert renders == [True]
+
+    def test_reset_map_cancels_waiting_render(self):
+        # given
+        mapper = self.get_mapper()
+        renders = self.record_renders(mapper)
+        mapper._schedule_render()
+
+        # when
+        mapper.reset_map(RoombaMap("test", "Test"))
+        mapper.wait_for_render()
+        mapper._render_executor.submit(lambda: None).result()
+
+        # then
+        assert renders == []
+        assert not mapper._render_pending
+
+    def test_close_stops_render_worker(self):
+        # given
+        mapper = self.get_mapper()
+        renders = self.record_renders(mapper)
+        mapper._schedule_render()
+        executor = mapper._render_executor
+
+        # when
+        mapper.close()
+        executor.shutdown(wait=True)
+
+        # then
+        assert renders == []
+        assert mapper._render_executor is None
+        assert mapper._render_future is None
+
+        # and a later render starts a new worker
+        mapper._schedule_render(force_redraw=True)
+        mapper.wait_for_render()
+        assert renders == [True]
+        mapper.close()
+
+    def test_rebuild_does_not_wait_for_render(self):
+        # given
+        mapper = self.get_mapper()
+        mapper._append_pose(0, 0, 0)
+        mapper._append_pose(10, 10, 0)
+        rendering = threading.Event()
+        done = threading.Event()
+        released = threading.Event()
+
+        def render():
+            with mapper._lock:
+                rendering.set()
+                done.wait(5)
+                released.set()
+
+        worker = threading.Thread(target=render)
+        worker.start()
+        rendering.wait(5)
+
+        # when
+        try:
+            mapper._rebuild_translated_history()
+            rebuilt = not released.is_set()
+        finally:
+            done.set()
+            worker.join()
+
+        # then
+        assert rebuilt
+        assert mapper._history_img_len == 2
+        assert mapper._path_stale
+
+    def test_wait_for_render_raises_render_errors(self):
+        # given
+        mapper = self.get_mapper()
+
+        def fail(force_redraw):
+            raise RuntimeError("render failed")
+
+        mapper._render_map = fail
+
+        # when
+        mapper._schedule_render(force_redraw=True)
+
+        # then
+        with pytest.raises(RuntimeError):
+            mapper.wait_for_render()
+
+    def test_incremental_path_matches_full_redraw(self):
+        # given
+        mapper = self.get_mapper(
+            RoombaMap(
+                "test",
+                "Test",
+                coords_start=(-500, -500),
+                coords_end=(500, 500),
+                angle=20,
+            )
+        )
+        for i in range(60):
+            mapper._append_pose(
+                400 * math.cos(i / 5) * (1 - i / 80), 400 * math.sin(i / 3), i * 7
+            )
+        mapper._rebuild_translated_history()
+        poses = mapper._history_img_len
+
+        # when
+        mapper._reset_path_layer()
+        for n in range(1, poses + 1):
+            mapper._history_img_len = n
+            mapper._draw_vacuum_path()
+        incremental = mapper._map_layer.tobytes()
+
+        # then
+        assert incremental == mapper._compose_map_layer().tobytes()
+        mapper._rebuild_translated_history()
+        assert mapper._path_stale
+        mapper._reset_path_layer()
+        mapper._draw_vacuum_path()
+        assert incremental == mapper._map_layer.tobytes()
+
+    def test_validate_color_accepts_tuples(self):
+        default = (1, 2, 3, 4)
+
+        assert validate_color((10, 20, 30), default) == (10, 20, 30, 255)
+        assert validate_color((10, 20, 30, 40), default) == (10, 20, 30, 40)
+        assert validate_color((10, 20, 300), default) == default
+        assert validate_color((10, 20), default) == default
+        assert validate_color("red", default) == (255, 0, 0, 255)
+        assert validate_color("not a color", default) == default
+
+    def test_map_angle_accepts_numpy_scalars(self):
+        assert RoombaMap("test", "Test", angle=np.int64(90)).angle == 90.0
+        assert RoombaMap("test", "Test", angle=np.float32(-90)).angle == 270.0
+        assert RoombaMap("test", "Test", angle="45").angle == 45.0
+        assert RoombaMap("test", "Test", angle=[90]).angle == 0.0
+
+    def test_roomba_builds_without_numpy(self):
+        # given
+        script = "\n".join([
+            "import sys",
+            "sys.modules['numpy'] = None",
+            "from roombapy.mapping import RoombaMap",
+            "from tests.abstract_test_roomba import AbstractTestRoomba",
+            "roomba = AbstractTestRoomba.get_default_roomba()",
+            "roomba.master_state = {'state': {'reported': {'cap': {'pose': 1}}}}",
+            "roomba._mapper.reset_map(RoombaMap('test', 'Test'))",
+            "assert not roomba._mapper.map_enabled",
+            "assert roomba._mapper.min_coords == (0, 0)",
+        ])
+
+        # when
+        result = subprocess.run(
+            [sys.executable, "-c", script],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            capture_output=True,
+            text=True,
+        )
+
+        # then
+        assert result.returncode == 0, result.stderr